@@ -0,0 +1,79 @@
+'''
+Time aggDaily() with and without the data quality stage, and the stage on its own, on synthetic snapshots shaped like the DXY data.
+Run from the src directory:  python benchmark_data_quality.py [n_days] [n_cities] [snapshots_per_day]
+'''
+import io
+import sys
+import time
+import contextlib
+import datetime
+import numpy as np
+import pandas as pd
+import utils
+
+
+def synthetic_raw(n_days=60, n_cities=300, snapshots_per_day=3, seed=0):
+    '''Cumulative counts per city with a few revisions down, spikes, duplicate snapshots, and cities missing on some dates'''
+    rng = np.random.RandomState(seed)
+    n = n_days * n_cities * snapshots_per_day
+    day = np.repeat(np.arange(n_days), n_cities * snapshots_per_day)
+    city = np.tile(np.repeat(np.arange(n_cities), snapshots_per_day), n_days)
+    snapshot = np.tile(np.arange(snapshots_per_day), n_days * n_cities)
+    increments = rng.poisson(5, size=(n_cities, n_days * snapshots_per_day))
+    increments[rng.rand(*increments.shape) < .002] = -20
+    increments[rng.rand(*increments.shape) < .001] = 5000
+    cum = np.maximum(increments.cumsum(axis=1), 0)[city, day * snapshots_per_day + snapshot]
+
+    start = datetime.datetime(2020, 1, 24)
+    update_time = pd.to_datetime([start + datetime.timedelta(days=int(d), hours=int(8 * s)) for d, s in zip(day, snapshot)])
+    raw = pd.DataFrame({'continentName': '亚洲', 'continentEnglishName': 'Asia',
+                        'countryName': '中国', 'countryEnglishName': 'China',
+                        'province_name': ['省' + str(c // 20) for c in city],
+                        'provinceEnglishName': '', 'province_zipCode': 0,
+                        'city_name': ['市' + str(c) for c in city],
+                        'cityEnglishName': '', 'city_zipCode': city,
+                        'province_confirmed': 0, 'province_suspected': 0, 'province_cured': 0, 'province_dead': 0,
+                        'city_confirmed': cum, 'city_suspected': 0, 'city_cured': cum // 3, 'city_dead': cum // 30,
+                        'update_time': update_time})
+    raw['update_date'] = raw['update_time'].dt.date
+    incomplete_day = (day == n_days // 2) & (city % 3 == 0)
+    raw = raw[~incomplete_day]
+    return pd.concat([raw, raw.sample(frac=.001, random_state=seed)]).reset_index(drop=True)   # a few snapshots scraped twice
+
+
+def best_of(f, repeat=3):
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:]]
+    raw = synthetic_raw(*args)
+    daily = utils.aggDaily(raw)
+    print('Raw rows: ', len(raw), ' daily rows: ', len(daily))
+
+    # end to end, one run of each action per round so that drift of the machine affects them alike,
+    # and the summaries aggDaily() prints are silenced
+    actions = [None, 'flag', 'drop', 'ffill', 'clip']
+    times = dict([(action, []) for action in actions])
+    for i in range(5):
+        for action in actions:
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                utils.aggDaily(raw, quality_action=action)
+                times[action].append(time.perf_counter() - start)
+    base = min(times[None])
+    print('aggDaily(quality_action=None): %.3fs' % base)
+    for action in actions[1:]:
+        print('aggDaily(quality_action=%r): %.3fs (%+.3fs)' % (action, min(times[action]), min(times[action]) - base))
+
+    # the stage on its own, as the end to end difference is within the run to run noise of aggDaily()
+    t = best_of(lambda: utils.flag_duplicate_snapshots(raw))
+    print('flag_duplicate_snapshots: %.3fs' % t)
+    for action in ['flag', 'drop', 'ffill', 'clip']:
+        t = best_of(lambda: utils.clean_data_quality(daily, action=action, verbose=False))
+        print('clean_data_quality(action=%r): %.3fs' % (action, t))
@@ -131,8 +131,18 @@ def load_chinese_raw():
     return data   
 
 
-def aggDaily(df):
-    '''Aggregate the frequent time series data into a daily frame, ie, one entry per (date, province, city)'''
+def aggDaily(df, quality_action=None):
+    '''
+    Aggregate the frequent time series data into a daily frame, ie, one entry per (date, province, city)
+    quality_action: None to skip the data quality check, otherwise one of the actions of clean_data_quality().
+        Duplicate snapshots are checked on df first, and except for 'flag', only the last of them is kept
+    '''
+    if quality_action is not None:
+        duplicate = flag_duplicate_snapshots(df)
+        if duplicate.any():
+            print('Duplicate snapshots (rows): ' + str(duplicate.sum()))
+        if quality_action != 'flag':
+            df = df[~duplicate]
     frm_list = []
     drop_cols = ['province_' + field for field in ['confirmed', 'suspected', 'cured', 'dead']]  # these can be computed later
     drop_cols += ['provinceEnglishName', 'cityEnglishName', 'province_zipCode']
@@ -146,6 +156,8 @@ def aggDaily(df):
 
     #out = remove_abnormal_dates(out)
     out = add_daily_new(out)  # add daily new cases
+    if quality_action is not None:
+        out = clean_data_quality(out, action=quality_action)
     out = add_en_location(out)
     #out = out.set_index(['update_date'])
     
@@ -164,14 +176,14 @@ def remove_abnormal_dates(df):
     On some dates, very little provinces have reports (usually happens when just pass mid-night)
     Remove these dates for now.  When I have time, I can fill in previous value
     '''
-    if len(df['update_date']) < 2:
-        return
-    second_last_date, last_date = df['update_date'].iloc[-2:]
     city_count = df.groupby('update_date').agg({'city_name': pd.Series.nunique})
+    if len(city_count) < 2:
+        return df
+    last_date = city_count.index[-1]
     second_last_count, last_count = city_count['city_name'].iloc[-2:]
     if last_count < second_last_count * .95:   # 95% to give some margin
         print("The last date " + str(last_date) + " is removed due to insufficient cities reporting")
-        return df[~df['update_date'] == last_date]
+        return df[df['update_date'] != last_date]
     else:
         return df
 
@@ -272,6 +284,11 @@ def diff0(x):
     return np.diff(np.hstack([0, x]))
 
 
+def new_col_names(diff_cols):
+    '''cum_xxx -> new_xxx, otherwise xxx -> new_xxx'''
+    return [col.replace('cum', 'new') if 'cum_' in col else 'new_' + col for col in diff_cols]
+
+
 def add_daily_new(df, group_keys=['province_name', 'city_name'], diff_cols=['cum_confirmed', 'cum_dead', 'cum_cured'], date_col='update_date'):
     '''
     >>> df = pd.DataFrame({'update_date': [1, 2, 2, 3, 3], 
@@ -292,14 +309,8 @@ def add_daily_new(df, group_keys=['province_name', 'city_name'], diff_cols=['cum
     # Do NOT use the Pandas 'diff'.  Because it will result in the first element being NA. 
     # So if a city appears in a later date, its first "new_" will be NA (wrong), instead of the first  element (correct)
     daily_new = df.groupby(group_keys)[diff_cols].transform(diff0)
-    
-    new_cols = []
-    for col in diff_cols:
-        if 'cum_' in col:
-            new_cols.append(col.replace('cum', 'new'))
-        else:
-            new_cols.append('new_' + col)
-         
+
+    new_cols = new_col_names(diff_cols)
     daily_new = daily_new.rename(columns=dict(zip(diff_cols, new_cols)))
     df = pd.concat([df, daily_new], axis=1, join='outer')
  
@@ -307,7 +318,164 @@ def add_daily_new(df, group_keys=['province_name', 'city_name'], diff_cols=['cum
     first_data_date = df[date_col].min()
     df[new_cols] = df[new_cols].where(df[date_col] != first_data_date, np.nan)
     return df
-    
+
+
+_DATA_QUALITY_FLAGS_ = ['incomplete_date', 'negative', 'large']
+
+
+def flag_duplicate_snapshots(snapshots, group_keys=['province_name', 'city_name'], time_col='update_time'):
+    '''
+    All but the last row of each (location, time_col) snapshot reported more than once, whether or not the counts agree.
+    aggDaily() keeps only one row per (location, date), so this has to be checked on the snapshots before it
+    '''
+    return snapshots.duplicated(group_keys + [time_col], keep='last')
+
+
+def _running_baseline(df, group_keys, diff_cols, date_col, large_ratio, large_min, window):
+    '''
+    Check each count against the last accepted count of its location, rather than the previous row, so that once the bad rows
+    are dropped or replaced, the next row does not show the same jump again.  This runs one date at a time, over all locations at once.
+    A count deviates when it is below the baseline, or over it by more than max(large_min, large_ratio * the largest accepted
+    increment of the last window dates).  It is only an outlier if a count within the next window dates is back in line with
+    the baseline.  Otherwise the deviation lasts, so it is taken as a real jump or revision, and becomes the new baseline.
+    The first count of a location has no baseline, so it is always accepted.  Each metric is checked on its own.
+    Returns (negative, large, baseline, bound) per row and metric, baseline and bound being what the row is checked against
+    '''
+    loc_idx = df.groupby(group_keys, sort=False, dropna=False).ngroup().to_numpy()
+    date_idx, dates = pd.factorize(df[date_col], sort=True)
+    values = np.full((len(dates), loc_idx.max() + 1, len(diff_cols)), np.nan)
+    values[date_idx, loc_idx] = df[diff_cols].to_numpy(dtype=float)
+
+    negative = np.zeros(values.shape, dtype=bool)
+    large = np.zeros(values.shape, dtype=bool)
+    baseline = np.full(values.shape, np.nan)
+    bound = np.full(values.shape, np.nan)
+    base = np.full(values.shape[1:], np.nan)
+    recent = np.zeros((window,) + values.shape[1:])   # accepted increments of the last window dates
+    for t in range(len(dates)):
+        baseline[t] = base
+        bound[t] = np.maximum(large_min, large_ratio * recent.max(axis=0))
+        ahead = values[t + 1:t + 1 + window]
+        back = ((ahead >= base) & (ahead - base <= bound[t])).any(axis=0)
+        negative[t] = (values[t] < base) & back
+        large[t] = (values[t] - base > bound[t]) & back
+        accept = ~np.isnan(values[t]) & ~negative[t] & ~large[t]
+        recent[t % window] = np.where(accept & ~np.isnan(base), values[t] - base, 0)
+        base = np.where(accept, values[t], base)
+    rows = (date_idx, loc_idx)
+    return negative[rows], large[rows], baseline[rows], bound[rows]
+
+
+def flag_data_quality(df, group_keys=['province_name', 'city_name'], diff_cols=['cum_confirmed', 'cum_dead', 'cum_cured'], date_col='update_date',
+                      min_report_ratio=.95, large_ratio=5., large_min=500, window=3):
+    '''
+    Check the whole history at once.  df is sorted by date, eg. the output of add_daily_new().
+    Returns a boolean frame with the same index, one column per problem:
+      incomplete_date: on this date, fewer locations report than min_report_ratio of the previous date
+      negative: some cumulative count dips below the last accepted one of the location, and is back within window dates
+      large: some cumulative count jumps over the last accepted one by more than max(large_min, large_ratio * the largest
+             increment of the location in the last window dates), and is back within window dates
+    Dips and jumps that last are taken as real, and not flagged
+
+    A permanent drop in the number of locations only flags the first date of it
+    >>> df = pd.DataFrame({'update_date': [1, 1, 1, 2, 2, 2, 3, 3, 4, 4, 5, 5],
+    ...     'city_name': ['A', 'B', 'C', 'A', 'B', 'C', 'A', 'B', 'A', 'B', 'A', 'B'],
+    ...     'cum_confirmed': [1, 10, 5, 600, 8, 5, 50, 12, 60, 12, 70, 13]})
+    >>> flags = flag_data_quality(df, group_keys=['city_name'], diff_cols=['cum_confirmed'])
+    >>> print(flags.astype(int))
+        incomplete_date  negative  large
+    0                 0         0      0
+    1                 0         0      0
+    2                 0         0      0
+    3                 0         0      1
+    4                 0         1      0
+    5                 0         0      0
+    6                 1         0      0
+    7                 1         0      0
+    8                 0         0      0
+    9                 0         0      0
+    10                0         0      0
+    11                0         0      0
+    '''
+    flags = pd.DataFrame(index=df.index)
+    report_count = df.drop_duplicates(group_keys + [date_col]).groupby(date_col).size()
+    incomplete = report_count < report_count.shift(1) * min_report_ratio
+    flags['incomplete_date'] = df[date_col].map(incomplete).fillna(False).astype(bool)
+    negative, large, _, _ = _running_baseline(df, group_keys, diff_cols, date_col, large_ratio, large_min, window)
+    flags['negative'] = negative.any(axis=1)
+    flags['large'] = large.any(axis=1)
+    return flags
+
+
+def clean_data_quality(df, action='flag', group_keys=['province_name', 'city_name'], diff_cols=['cum_confirmed', 'cum_dead', 'cum_cured'], date_col='update_date',
+                       min_report_ratio=.95, large_ratio=5., large_min=500, window=3, verbose=True):
+    '''
+    Run flag_data_quality() on the output of add_daily_new(), print a summary if verbose, and fix the flagged rows according to action:
+      'flag': no change
+      'drop': remove incomplete dates as a whole, then rows with a flagged count.  Recompute the new_ columns
+      'ffill': fill in the locations missing on incomplete dates with their previous report, then replace flagged counts
+               with the last accepted ones.  Recompute the new_ columns
+      'clip': clip the new_ columns at 0, and flagged jumps at the bound they are checked against.  The cum_ columns are unchanged
+    A jump or revision that lasts is real, so it stays in the new_ columns, except that 'clip' clips revisions down to 0.
+
+    Wuhan's confirmed counts 2020-01-24 to 02-03, with a typo on 01-29.  The jump on 01-27 is real and kept
+    >>> df = pd.DataFrame({'update_date': pd.date_range('2020-01-24', '2020-02-03').date, 'city_name': '武汉',
+    ...     'cum_confirmed': [572, 618, 698, 1590, 1905, 19050, 2639, 3215, 4109, 5142, 6384]})
+    >>> df = add_daily_new(df, group_keys=['city_name'], diff_cols=['cum_confirmed'])
+    >>> for action in ['flag', 'drop', 'ffill', 'clip']:
+    ...     out = clean_data_quality(df, action, group_keys=['city_name'], diff_cols=['cum_confirmed'], verbose=False)
+    ...     print(action, out['new_confirmed'].tolist())
+    flag [nan, 46.0, 80.0, 892.0, 315.0, 17145.0, -16411.0, 576.0, 894.0, 1033.0, 1242.0]
+    drop [nan, 46.0, 80.0, 892.0, 315.0, 734.0, 576.0, 894.0, 1033.0, 1242.0]
+    ffill [nan, 46.0, 80.0, 892.0, 315.0, 0.0, 734.0, 576.0, 894.0, 1033.0, 1242.0]
+    clip [nan, 46.0, 80.0, 892.0, 315.0, 4460.0, 0.0, 576.0, 894.0, 1033.0, 1242.0]
+    '''
+    if action not in ['flag', 'drop', 'ffill', 'clip']:
+        raise ValueError("Unknown action: " + str(action))
+    flags = flag_data_quality(df, group_keys, diff_cols, date_col, min_report_ratio, large_ratio, large_min, window)
+    counts = flags.sum()
+    if verbose and counts.any():
+        print('Data quality issues (rows): ' + ', '.join([flag + '=' + str(counts[flag]) for flag in _DATA_QUALITY_FLAGS_]))
+    new_cols = new_col_names(diff_cols)
+
+    if action == 'drop':
+        df = df[~flags['incomplete_date']]
+        negative, large, _, _ = _running_baseline(df, group_keys, diff_cols, date_col, large_ratio, large_min, window)   # the last kept row may change
+        df = df[~(negative | large).any(axis=1)]
+    elif action == 'ffill':
+        incomplete_dates = df.loc[flags['incomplete_date'], date_col].unique()
+        if len(incomplete_dates) > 0:
+            df = _fill_incomplete_dates(df, incomplete_dates, group_keys, date_col)
+        negative, large, baseline, _ = _running_baseline(df, group_keys, diff_cols, date_col, large_ratio, large_min, window)
+        bad = (negative | large) & ~np.isnan(baseline)
+        dtypes = df[diff_cols].dtypes
+        df = df.copy()
+        df[diff_cols] = np.where(bad, baseline, df[diff_cols].to_numpy(dtype=float))
+        df[diff_cols] = df[diff_cols].astype(dtypes)
+    elif action == 'clip':
+        _, large, _, bound = _running_baseline(df, group_keys, diff_cols, date_col, large_ratio, large_min, window)
+        df = df.copy()
+        df[new_cols] = np.clip(df[new_cols].to_numpy(dtype=float), 0, np.where(large, bound, np.inf))
+        return df
+    else:
+        return df
+    return add_daily_new(df.drop(columns=new_cols), group_keys, diff_cols, date_col)
+
+
+def _fill_incomplete_dates(df, dates, group_keys, date_col):
+    '''Add a row for every location missing on each of the dates, copied from its latest earlier row'''
+    key = '_date_key'
+    grid = df[group_keys].drop_duplicates().merge(pd.DataFrame({date_col: dates}), how='cross')
+    grid = grid.merge(df[group_keys + [date_col]].assign(_present=True), how='left', on=group_keys + [date_col])
+    grid = grid[grid['_present'].isnull()].drop(columns='_present')
+    grid[key] = pd.to_datetime(grid[date_col])
+
+    src = df.drop(columns=date_col).assign(**{key: pd.to_datetime(df[date_col]), '_found': True})
+    filled = pd.merge_asof(grid.sort_values(key), src.sort_values(key), on=key, by=group_keys, allow_exact_matches=False)
+    filled = filled[filled['_found'].notnull()][df.columns]   # locations appearing only after the date are not filled
+    out = pd.concat([df, filled.astype(df.dtypes)]).sort_values([date_col] + group_keys, kind='mergesort')
+    return out.reset_index(drop=True)
+
     
 def tsplot_conf_dead_cured(df, figsize=(13,10), fontsize=18, logy=False, title=None):
     fig = plt.figure()
@@ -389,7 +557,222 @@ def stack_frames_by_date(df, date_col, cat_col, val_col='positive_rate'):
         else:
             frm =pd.concat([frm, subfrm], axis=1)
     return frm
-            
+
+
+_CUBE_MANIFEST_FILE_ = 'manifest.csv'
+_CUBE_FILES_ = {'data': 'cube.{}.dat', 'locations': 'locations.{}.csv', 'dates': 'dates.{}.csv', 'metrics': 'metrics.{}.csv'}
+_CUBE_DTYPE_ = np.float64
+
+
+def _cube_slabs(df, locations, dates, location_cols, value_cols, date_col):
+    '''
+    Scatter the long frame into a dense (date, location, metric) array, NaN where nothing is reported.
+    If a (location, date) appears more than once, the last row wins, so df should be sorted stably.
+    '''
+    slabs = np.full((len(dates), len(locations), len(value_cols)), np.nan, dtype=_CUBE_DTYPE_)
+    loc_idx = pd.MultiIndex.from_frame(locations).get_indexer(pd.MultiIndex.from_frame(df[location_cols]))
+    date_idx = pd.Index(dates).get_indexer(pd.to_datetime(df[date_col]))
+    slabs[date_idx, loc_idx] = df[value_cols].to_numpy(dtype=_CUBE_DTYPE_)
+    return slabs
+
+
+def _ffill_dates(slabs, last=None):
+    '''
+    Forward fill NaN along the date axis (axis 0), since a location not reporting on a date keeps its cumulative counts.
+    last, if given, is the slab of the date just before slabs[0]
+    '''
+    if last is not None:
+        slabs = np.concatenate([last[np.newaxis], slabs])
+    idx = np.where(np.isnan(slabs), 0, np.arange(slabs.shape[0])[:, np.newaxis, np.newaxis])
+    np.maximum.accumulate(idx, axis=0, out=idx)
+    slabs = np.take_along_axis(slabs, idx, axis=0)
+    return slabs[1:] if last is not None else slabs
+
+
+def _cube_locations(df, location_cols):
+    locations = df[location_cols].drop_duplicates().fillna('').astype(str)
+    return locations.sort_values(location_cols).reset_index(drop=True)
+
+
+def _prepare_cube_frame(df, location_cols, date_col):
+    df = df.copy()
+    df[location_cols] = df[location_cols].fillna('').astype(str)
+    return df.sort_values(date_col, kind='mergesort')   # stable, so the last row of a (location, date) in df wins
+
+
+def _read_cube_manifest(path):
+    '''The manifest names the current version of each file, None if there is no cube under path'''
+    manifest_file = os.path.join(path, _CUBE_MANIFEST_FILE_)
+    if not os.path.exists(manifest_file):
+        return None
+    return pd.read_csv(manifest_file).iloc[0].to_dict()
+
+
+def _commit_cube(path, manifest, old_manifest):
+    '''
+    Readers only open the files named in the manifest, so switch to the new version by replacing the manifest atomically.
+    Files of the previous version are kept, for readers who have just read the old manifest, older ones are removed.
+    '''
+    tmp_file = os.path.join(path, _CUBE_MANIFEST_FILE_ + '.tmp')
+    pd.DataFrame([manifest]).to_csv(tmp_file, index=False)
+    os.replace(tmp_file, os.path.join(path, _CUBE_MANIFEST_FILE_))
+    keep = set(manifest[kind] for kind in _CUBE_FILES_)
+    if old_manifest is not None:
+        keep |= set(old_manifest[kind] for kind in _CUBE_FILES_)
+    for name in os.listdir(path):
+        if name not in keep and any(name.startswith(f.split('{}')[0]) and name.endswith(f.split('{}')[1]) for f in _CUBE_FILES_.values()):
+            os.remove(os.path.join(path, name))
+
+
+def export_cube(df, path, location_cols=['province_name', 'city_name'], value_cols=['cum_confirmed', 'cum_dead', 'cum_cured'], date_col='update_date'):
+    '''
+    Materialize a long frame (eg. the output of aggDaily) into a dense (location, date, metric) cube on disk under directory path.
+    The values go to a raw float64 file stored date-major, so that extend_cube() only appends to the end of it,
+    and the coordinates go to small CSV files next to it.  Missing (location, date) are forward filled along dates.
+    For JHU data, use location_cols=['Country_Region', 'Province_State', 'Admin2'], value_cols=['Confirmed', 'Deaths', 'Recovered'], date_col='Update_Date'
+    Returns the cube, as from load_cube()
+
+    >>> import tempfile
+    >>> path = tempfile.mkdtemp()
+    >>> df = pd.DataFrame({'update_date': ['2020-02-01', '2020-02-01', '2020-02-03'],
+    ...     'province_name': ['P', 'Q', 'P'],
+    ...     'city_name': ['A', 'B', 'A'],
+    ...     'cum_confirmed': [1, 5, 3]})
+    >>> cube, locations, dates, metrics = export_cube(df, path, value_cols=['cum_confirmed'])
+    >>> print(cube[:, :, 0])
+    [[1. 3.]
+     [5. 5.]]
+    >>> size = os.path.getsize(os.path.join(path, _read_cube_manifest(path)['data']))
+
+    Same locations: the last date is refreshed into a new data file, and the new date added after it
+    >>> new = pd.DataFrame({'update_date': ['2020-02-03', '2020-02-04'],
+    ...     'province_name': ['Q', 'P'],
+    ...     'city_name': ['B', 'A'],
+    ...     'cum_confirmed': [6, 4]})
+    >>> cube, locations, dates, metrics = extend_cube(new, path)
+    >>> print(cube[:, :, 0])
+    [[1. 3. 4.]
+     [5. 6. 6.]]
+    >>> os.path.getsize(os.path.join(path, _read_cube_manifest(path)['data'])) - size == 2 * 8
+    True
+
+    Only later dates: they are appended to the same data file
+    >>> data_file, size = _read_cube_manifest(path)['data'], os.path.getsize(os.path.join(path, _read_cube_manifest(path)['data']))
+    >>> new = pd.DataFrame({'update_date': ['2020-02-05'], 'province_name': ['P'], 'city_name': ['A'], 'cum_confirmed': [5]})
+    >>> cube, locations, dates, metrics = extend_cube(new, path)
+    >>> print(cube[:, :, 0])
+    [[1. 3. 4. 5.]
+     [5. 6. 6. 6.]]
+    >>> _read_cube_manifest(path)['data'] == data_file, os.path.getsize(os.path.join(path, data_file)) - size == 2 * 8
+    (True, True)
+
+    A new location: the cube is rewritten with the locations sorted again
+    >>> new = pd.DataFrame({'update_date': ['2020-02-06'], 'province_name': ['P'], 'city_name': ['0'], 'cum_confirmed': [7]})
+    >>> cube, locations, dates, metrics = extend_cube(new, path)
+    >>> print(locations)
+      province_name city_name
+    0             P         0
+    1             P         A
+    2             Q         B
+    >>> print(cube[:, :, 0])
+    [[nan nan nan nan  7.]
+     [ 1.  3.  4.  5.  5.]
+     [ 5.  6.  6.  6.  6.]]
+    '''
+    if len(df) == 0:
+        raise ValueError("Cannot export an empty frame to a cube")
+    df = _prepare_cube_frame(df, location_cols, date_col)
+    locations = _cube_locations(df, location_cols)
+    dates = pd.DatetimeIndex(pd.to_datetime(df[date_col]).unique(), name=date_col).sort_values()
+    slabs = _ffill_dates(_cube_slabs(df, locations, dates, location_cols, value_cols, date_col))
+
+    os.makedirs(path, exist_ok=True)
+    old_manifest = _read_cube_manifest(path)
+    version = 0 if old_manifest is None else old_manifest['version'] + 1
+    manifest = dict([(kind, f.format(version)) for kind, f in _CUBE_FILES_.items()], version=version)
+    slabs.tofile(os.path.join(path, manifest['data']))
+    locations.to_csv(os.path.join(path, manifest['locations']), index=False, encoding='utf-8')
+    pd.DataFrame({date_col: dates.strftime('%Y-%m-%d')}).to_csv(os.path.join(path, manifest['dates']), index=False)
+    pd.DataFrame({'metric': value_cols}).to_csv(os.path.join(path, manifest['metrics']), index=False)
+    _commit_cube(path, manifest, old_manifest)
+    return load_cube(path)
+
+
+def load_cube(path, mode='r'):
+    '''
+    Reopen a cube written by export_cube().  The values are memory mapped, so nothing is read until used,
+    and many processes opening the same cube share the OS page cache instead of each holding a copy.
+    Returns (cube, locations, dates, metrics), where cube[i, j, k] is metrics[k] of locations.iloc[i] on dates[j].
+    The cube is a transposed view on the date-major file, use np.ascontiguousarray() if a location-major copy is needed.
+    A cube opened before extend_cube() keeps its shape and values.
+    mode: 'r' for read only, or 'c' for copy-on-write, ie. changes stay in memory and never reach the shared file
+    '''
+    if mode not in ['r', 'c']:
+        raise ValueError("mode must be 'r' or 'c', the cube files are only written by export_cube() and extend_cube(): " + str(mode))
+    manifest = _read_cube_manifest(path)
+    if manifest is None:
+        raise ValueError("No cube found under " + path)
+    locations = pd.read_csv(os.path.join(path, manifest['locations']), encoding='utf-8', dtype=str, keep_default_na=False)
+    date_frm = pd.read_csv(os.path.join(path, manifest['dates']))
+    dates = pd.DatetimeIndex(pd.to_datetime(date_frm.iloc[:, 0]), name=date_frm.columns[0])
+    metrics = list(pd.read_csv(os.path.join(path, manifest['metrics']))['metric'])
+    shape = (len(dates), len(locations), len(metrics))
+    slabs = np.memmap(os.path.join(path, manifest['data']), dtype=_CUBE_DTYPE_, mode=mode, shape=shape)
+    return slabs.transpose(1, 0, 2), locations, dates, metrics
+
+
+def extend_cube(df, path):
+    '''
+    Add the dates in df from the last date of the cube under path on.  Earlier dates are ignored.
+    The last date is usually partial (eg. intraday for DXY), so it is refreshed: values in df replace the stored ones.
+    If df has only later dates and no new location, they are appended to the data file in use, after the part that readers map.
+    If the last date is refreshed, the stored dates before it are copied into a new data file, and the new values appended there.
+    If there are new locations, the location axis changes, and the whole cube is rewritten into a new data file.
+    Either way, readers only see the new dates once the manifest is replaced.
+    Returns the cube, as from load_cube()
+    '''
+    manifest = _read_cube_manifest(path)
+    cube, locations, dates, metrics = load_cube(path)
+    location_cols, date_col = list(locations.columns), dates.name
+    df = df[pd.to_datetime(df[date_col]) >= dates[-1]]
+    if len(df) == 0:
+        return cube, locations, dates, metrics
+    df = _prepare_cube_frame(df, location_cols, date_col)
+    new_dates = pd.DatetimeIndex(pd.to_datetime(df[date_col]).unique(), name=date_col).sort_values()
+    keep_count = len(dates) - 1 if new_dates[0] == dates[-1] else len(dates)   # number of stored dates left as is
+    all_dates = dates[:keep_count].append(new_dates)
+
+    new_manifest = dict(manifest, version=manifest['version'] + 1)
+    new_manifest['dates'] = _CUBE_FILES_['dates'].format(new_manifest['version'])
+    all_locations = _cube_locations(pd.concat([locations, df[location_cols]]), location_cols)
+    if len(all_locations) == len(locations):
+        slabs = _cube_slabs(df, locations, new_dates, location_cols, metrics, date_col)
+        slabs = _ffill_dates(slabs, last=cube[:, -1, :])
+        if keep_count < len(dates):
+            # the last date is refreshed, so copy the rest into a new data file rather than overwrite the one readers may be using
+            new_manifest['data'] = _CUBE_FILES_['data'].format(new_manifest['version'])
+            cube.transpose(1, 0, 2)[:keep_count].tofile(os.path.join(path, new_manifest['data']))
+        # write at the end of the part in use rather than the end of the file, in case an earlier run died before the manifest was replaced
+        with open(os.path.join(path, new_manifest['data']), 'r+b') as f:
+            f.seek(keep_count * slabs[0].nbytes)
+            slabs.tofile(f)
+            f.truncate()
+    else:
+        old = np.full((keep_count, len(all_locations), len(metrics)), np.nan, dtype=_CUBE_DTYPE_)
+        old[:, pd.MultiIndex.from_frame(all_locations).get_indexer(pd.MultiIndex.from_frame(locations))] = cube[:, :keep_count].transpose(1, 0, 2)
+        last = np.full((len(all_locations), len(metrics)), np.nan, dtype=_CUBE_DTYPE_)
+        last[pd.MultiIndex.from_frame(all_locations).get_indexer(pd.MultiIndex.from_frame(locations))] = cube[:, -1, :]
+        slabs = _cube_slabs(df, all_locations, new_dates, location_cols, metrics, date_col)
+        slabs = np.concatenate([old, _ffill_dates(slabs, last=last)])
+        new_manifest['data'] = _CUBE_FILES_['data'].format(new_manifest['version'])
+        new_manifest['locations'] = _CUBE_FILES_['locations'].format(new_manifest['version'])
+        slabs.tofile(os.path.join(path, new_manifest['data']))
+        all_locations.to_csv(os.path.join(path, new_manifest['locations']), index=False, encoding='utf-8')
+    pd.DataFrame({date_col: all_dates.strftime('%Y-%m-%d')}).to_csv(os.path.join(path, new_manifest['dates']), index=False)
+    del cube
+    _commit_cube(path, new_manifest, manifest)
+    return load_cube(path)
+
 
 def IL_death_demographic_early():
     '''On or before 2020-03-27, IDPH release death demographics in a more random format, so manual input here'''